@@ -1,25 +1,46 @@
-from openai import OpenAI
 from datetime import datetime
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import hashlib
 import json
+import multiprocessing
+import re
 import requests
+import threading
 from bs4 import BeautifulSoup
 import os
 from dotenv import load_dotenv
 import time
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client with API key from environment variable
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+# OpenAI client, created on first use so parse worker processes never import it
+client = None
+client_lock = threading.Lock()
 
-print("Starting scraper...")
-print(f"OpenAI API Key present: {'Yes' if os.getenv('OPENAI_API_KEY') else 'No'}")
+def get_openai_client():
+    """
+    Get the OpenAI client, initializing it with the API key from the environment
+    """
+    global client
+    with client_lock:
+        if client is None:
+            from openai import OpenAI
+            client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        return client
 
 def get_webpage_content(url):
     """
-    Fetch webpage content with error handling and retries
+    Fetch raw webpage bytes with error handling and retries.
+
+    Returns the response body and the encoding reported by the server so the
+    page can be parsed later, possibly in another process.
     """
     print(f"Fetching content from: {url}")
     max_retries = 3
@@ -30,7 +51,7 @@ def get_webpage_content(url):
             response = requests.get(url, timeout=10)
             response.raise_for_status()
             print(f"Successfully fetched content from {url}")
-            return BeautifulSoup(response.text, 'html.parser'), response.text
+            return response.content, response.encoding
         except requests.RequestException as e:
             if attempt == max_retries - 1:
                 print(f"Error fetching webpage: {e}")
@@ -359,9 +380,122 @@ def get_kolga_menu(soup, current_day):
         print(f"Error in get_kolga_menu: {e}")
         return None, None
 
-def get_restaurant_info(restaurant_name, url):
+# Known lunch prices for restaurants
+KNOWN_PRICES = {
+    "Bullen": "145 kr",
+    "Saltimporten": "135 kr",
+    "Välfärden": "115 kr",
+    "Friis 14": "159 kr",
+    "Folk, Mat & Möten": "169 kr",
+    "Hamn & Peppar": "120 kr",
+    "Kolga": "125 kr"
+}
+
+# Template text from the AI prompt that must never end up in lunch_data.json
+PLACEHOLDER_PATTERN = re.compile(
+    r"description of today's lunch|MUST be for|second option if available|price in kr|^\s*item\d+\s*$",
+    re.IGNORECASE
+)
+
+def check_menu_text(field, value):
     """
-    Use AI to extract lunch information from a restaurant's website
+    Raise ValueError unless value is a string that is not prompt template text
+    """
+    if not isinstance(value, str):
+        raise ValueError(f"{field} must be a string, got {value!r}")
+    if PLACEHOLDER_PATTERN.search(value):
+        raise ValueError(f"{field} is a placeholder: {value!r}")
+
+class MenuRecord:
+    """
+    A restaurant's lunch menu for one day, as written to lunch_data.json
+    """
+    __slots__ = (
+        "restaurant_name",
+        "url",
+        "daily_special",
+        "price",
+        "included_items",
+        "lunch_hours",
+        "special_notes",
+        "day_of_week",
+        "date"
+    )
+
+    def __init__(self, restaurant_name, url, daily_special, price, included_items=None,
+                 lunch_hours="11:30-14:00", special_notes="", day_of_week="", date=""):
+        if not restaurant_name or not url:
+            raise ValueError("restaurant_name and url are required")
+
+        # daily_special may be missing, a single text or a list of options
+        if isinstance(daily_special, (list, tuple)):
+            daily_special = list(daily_special)
+            for option in daily_special:
+                check_menu_text("daily_special", option)
+        elif daily_special is not None:
+            check_menu_text("daily_special", daily_special)
+
+        # A single included item is wrapped instead of being split into characters
+        if included_items is None:
+            included_items = []
+        elif isinstance(included_items, str):
+            included_items = [included_items]
+        elif isinstance(included_items, (list, tuple)):
+            included_items = list(included_items)
+        else:
+            raise ValueError(f"included_items must be a list of strings, got {included_items!r}")
+        for item in included_items:
+            check_menu_text("included_items", item)
+
+        for field, value in (
+            ("restaurant_name", restaurant_name),
+            ("url", url),
+            ("price", price),
+            ("lunch_hours", lunch_hours),
+            ("special_notes", special_notes),
+            ("day_of_week", day_of_week),
+            ("date", date)
+        ):
+            check_menu_text(field, value)
+
+        self.restaurant_name = restaurant_name
+        self.url = url
+        self.daily_special = daily_special
+        self.price = price
+        self.included_items = included_items
+        self.lunch_hours = lunch_hours
+        self.special_notes = special_notes
+        self.day_of_week = day_of_week
+        self.date = date
+
+    # Optional fields that fall back to their defaults instead of rejecting the record
+    OPTIONAL_TEXT_FIELDS = ("lunch_hours", "special_notes")
+
+    @classmethod
+    def from_dict(cls, data, **known):
+        """
+        Build a record from a dict such as a parsed AI response, ignoring unknown keys.
+
+        Values passed as keyword arguments override the dict, and unusable optional
+        text fields are replaced by their defaults, so only a bad menu is rejected.
+        """
+        fields = {name: data[name] for name in cls.__slots__ if name in data}
+        for name in cls.OPTIONAL_TEXT_FIELDS:
+            value = fields.get(name)
+            if name in fields and (not isinstance(value, str) or PLACEHOLDER_PATTERN.search(value)):
+                del fields[name]
+        fields.update(known)
+        return cls(**fields)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"MenuRecord({self.restaurant_name!r}, {self.day_of_week!r})"
+
+def get_current_day():
+    """
+    Get today's weekday index, Swedish day name and formatted Swedish date
     """
     # Get current weekday (0 = Monday, 6 = Sunday)
     current_weekday = datetime.now().weekday()
@@ -383,23 +517,26 @@ def get_restaurant_info(restaurant_name, url):
     year = datetime.now().year
     
     formatted_date = f"{current_day} den {day}:e {month} {year}"
+    return current_weekday, current_day, formatted_date
 
-    # If it's a weekend, return "Lunch serveras ej" message
-    if current_weekday > 4:  # Saturday (5) or Sunday (6)
-        data = {
-            "restaurant_name": restaurant_name,
-            "url": url,
-            "daily_special": f"Lunch serveras ej på {current_day}",
-            "price": "0 kr",
-            "included_items": [],
-            "lunch_hours": "Ej servering",
-            "special_notes": "",
-            "day_of_week": current_day,
-            "date": formatted_date
-        }
-        return json.dumps(data)
-
-    # Handle Kolga's alternating weekly URLs
+def get_weekend_info(restaurant_name, url, current_day, formatted_date):
+    """
+    Build the "Lunch serveras ej" entry used on weekends
+    """
+    return MenuRecord(
+        restaurant_name=restaurant_name,
+        url=url,
+        daily_special=f"Lunch serveras ej på {current_day}",
+        price="0 kr",
+        lunch_hours="Ej servering",
+        day_of_week=current_day,
+        date=formatted_date
+    )
+
+def resolve_restaurant_url(restaurant_name, url):
+    """
+    Get the URL to fetch for a restaurant, handling Kolga's alternating weekly URLs
+    """
     if restaurant_name == "Kolga":
         # Get the current week number
         current_week = datetime.now().isocalendar()[1]
@@ -409,29 +546,23 @@ def get_restaurant_info(restaurant_name, url):
         else:
             url = "https://kolga.gastrogate.com/lunch/"
         print(f"Using Kolga URL for week {current_week}: {url}")
+    return url
 
-    # First get the webpage content
-    soup, webpage_content = get_webpage_content(url)
-    if not webpage_content:
-        print(f"Could not fetch content from {url}")
-        return None
+def parse_restaurant_page(restaurant_name, url, content, encoding, current_day):
+    """
+    Parse raw page bytes and extract the menu for a restaurant.
+
+    This is the CPU-bound part of scraping and is safe to run in a worker
+    process: it takes only plain values and returns a small dict with
+    daily_special, included_items, price and cleaned_content.
+    """
+    soup = BeautifulSoup(content, 'html.parser', from_encoding=encoding)
 
     # Clean and reduce webpage content
     cleaned_content = clean_webpage_content(soup)
     
-    # Dictionary of known prices for restaurants
-    known_prices = {
-        "Bullen": "145 kr",
-        "Saltimporten": "135 kr",
-        "Välfärden": "115 kr",
-        "Friis 14": "159 kr",
-        "Folk, Mat & Möten": "169 kr",
-        "Hamn & Peppar": "120 kr",
-        "Kolga": "125 kr"
-    }
-    
     # Get the price from known prices or try to extract it
-    price = known_prices.get(restaurant_name)
+    price = KNOWN_PRICES.get(restaurant_name)
     if not price:
         try:
             # Look for common price patterns in Swedish
@@ -449,7 +580,6 @@ def get_restaurant_info(restaurant_name, url):
             
             # Look for price in text
             for pattern in price_patterns:
-                import re
                 match = re.search(pattern, text_content, re.IGNORECASE)
                 if match:
                     price_value = int(match.group(1))
@@ -475,19 +605,7 @@ def get_restaurant_info(restaurant_name, url):
     elif restaurant_name == "Friis 14":
         daily_special, included_items = get_friis_menu(soup, current_day)
         if daily_special == "Stängt idag":
-            # Create a special data object for when Friis 14 is closed
-            data = {
-                "restaurant_name": restaurant_name,
-                "url": url,
-                "daily_special": ["Stängt idag"],
-                "price": known_prices.get(restaurant_name, "159 kr"),
-                "included_items": [],
-                "lunch_hours": "Ej servering",
-                "special_notes": "",
-                "day_of_week": current_day,
-                "date": formatted_date
-            }
-            return json.dumps(data)
+            print("Friis 14 is closed today")
         elif daily_special:
             cleaned_content = f"{current_day}\n{daily_special}"  # Override cleaned content with just the relevant menu
             print(f"Found Friis 14 menu for {current_day}: {daily_special}")
@@ -511,23 +629,67 @@ def get_restaurant_info(restaurant_name, url):
             print(f"Found Kolga menu for {current_day}: {daily_special}")
             print(f"Found Kolga included items: {included_items}")
 
-    # Prepare the daily_special value
-    daily_special_value = daily_special if daily_special else f"description of today's lunch (or array of options if multiple) - MUST be for {current_day}"
+    return {
+        "daily_special": daily_special,
+        "included_items": included_items,
+        "price": price,
+        "cleaned_content": cleaned_content
+    }
+
+def build_restaurant_info(restaurant_name, url, page, current_day, formatted_date):
+    """
+    Use the parsed page, falling back to AI, to build a restaurant's lunch information
+    """
+    daily_special = page["daily_special"]
+    included_items = page["included_items"]
+    cleaned_content = page["cleaned_content"]
+
+    if restaurant_name == "Friis 14" and daily_special == "Stängt idag":
+        # Create a special data object for when Friis 14 is closed
+        return MenuRecord(
+            restaurant_name=restaurant_name,
+            url=url,
+            daily_special=["Stängt idag"],
+            price=KNOWN_PRICES.get(restaurant_name, "159 kr"),
+            lunch_hours="Ej servering",
+            day_of_week=current_day,
+            date=formatted_date
+        )
+
+    # Record used when neither the custom handlers nor the API give a usable menu.
+    # A missing daily_special is shown as "Ingen dagens serveras idag" on the page.
+    def fallback_record():
+        def record(daily_special, included_items):
+            return MenuRecord(
+                restaurant_name=restaurant_name,
+                url=url,
+                daily_special=daily_special,
+                price=KNOWN_PRICES.get(restaurant_name, "159 kr"),  # Use known price or default to Friis 14 price
+                included_items=included_items,
+                day_of_week=current_day,
+                date=formatted_date
+            )
+        try:
+            return record(daily_special, included_items)
+        except ValueError as e:
+            print(f"Invalid menu for {restaurant_name}: {e}")
+            return record(None, None)
     
-    # If we have the menu data from custom handlers, create a basic JSON object
+    # If we have the menu data from custom handlers, create a basic record
     if daily_special and included_items:
-        data = {
-            "restaurant_name": restaurant_name,
-            "url": url,
-            "daily_special": included_items if isinstance(included_items, list) else [daily_special],
-            "price": known_prices.get(restaurant_name, "159 kr"),  # Use known price or default to Friis 14 price
-            "included_items": included_items if isinstance(included_items, list) else [daily_special],
-            "lunch_hours": "11:30-14:00",
-            "special_notes": "",
-            "day_of_week": current_day,
-            "date": formatted_date
-        }
-        return json.dumps(data)
+        try:
+            return MenuRecord(
+                restaurant_name=restaurant_name,
+                url=url,
+                daily_special=included_items if isinstance(included_items, list) else [daily_special],
+                price=KNOWN_PRICES.get(restaurant_name, "159 kr"),  # Use known price or default to Friis 14 price
+                included_items=included_items if isinstance(included_items, list) else [daily_special],
+                day_of_week=current_day,
+                date=formatted_date
+            )
+        except ValueError as e:
+            print(f"Invalid menu from custom handler for {restaurant_name}: {e}")
+            return fallback_record()
 
     # If we don't have custom handler data, try the API
     max_retries = 3
@@ -556,7 +718,7 @@ Return only the JSON object, no other text."""
     for attempt in range(max_retries):
         try:
             print(f"Attempting OpenAI API call for {restaurant_name} (attempt {attempt + 1}/{max_retries})...")
-            response = client.chat.completions.create(
+            response = get_openai_client().chat.completions.create(
                 model="gpt-3.5-turbo",
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant that extracts lunch menu information from restaurant websites. Return only the requested JSON object, no other text."},
@@ -571,26 +733,27 @@ Return only the JSON object, no other text."""
             try:
                 cleaned_response = response_text.replace('```json', '').replace('```', '').strip()
                 data = json.loads(cleaned_response)
-                # Ensure we use the known price if available
-                if restaurant_name in known_prices:
-                    data["price"] = known_prices[restaurant_name]
-                return json.dumps(data)
+                # Ensure we use the known price if available, or a usable price from the response
+                price = KNOWN_PRICES.get(restaurant_name, data.get("price"))
+                if not isinstance(price, str) or not price or PLACEHOLDER_PATTERN.search(price):
+                    price = "159 kr"  # Default to Friis 14 price
+                # Pin what the scraper already knows instead of trusting the model
+                return MenuRecord.from_dict(
+                    data,
+                    restaurant_name=restaurant_name,
+                    url=url,
+                    price=price,
+                    day_of_week=current_day,
+                    date=formatted_date
+                )
             except json.JSONDecodeError as e:
                 print(f"Error parsing JSON for {restaurant_name}: {e}")
                 print(f"Raw response: {response_text}")
-                # Create a basic JSON object with the information we have
-                data = {
-                    "restaurant_name": restaurant_name,
-                    "url": url,
-                    "daily_special": daily_special_value,
-                    "price": known_prices.get(restaurant_name, "159 kr"),  # Use known price or default to Friis 14 price
-                    "included_items": included_items if included_items else [],
-                    "lunch_hours": "11:30-14:00",
-                    "special_notes": "",
-                    "day_of_week": current_day,
-                    "date": formatted_date
-                }
-                return json.dumps(data)
+                # Create a basic record with the information we have
+                return fallback_record()
+            except (AttributeError, TypeError, ValueError) as e:
+                print(f"Invalid menu in API response for {restaurant_name}: {e}")
+                return fallback_record()
                 
         except Exception as e:
             print(f"Attempt {attempt + 1} failed for {restaurant_name}:")
@@ -603,23 +766,127 @@ Return only the JSON object, no other text."""
                 print(f"Retrying in {retry_delay} seconds...")
                 time.sleep(retry_delay)
             else:
-                # If all retries failed, create a basic JSON object with what we have
-                data = {
-                    "restaurant_name": restaurant_name,
-                    "url": url,
-                    "daily_special": daily_special_value,
-                    "price": known_prices.get(restaurant_name, "159 kr"),  # Use known price or default to Friis 14 price
-                    "included_items": included_items if included_items else [],
-                    "lunch_hours": "11:30-14:00",
-                    "special_notes": "",
-                    "day_of_week": current_day,
-                    "date": formatted_date
-                }
-                return json.dumps(data)
+                # If all retries failed, create a basic record with what we have
+                return fallback_record()
+
+def get_restaurant_info(restaurant_name, url):
+    """
+    Use AI to extract lunch information from a restaurant's website
+    """
+    current_weekday, current_day, formatted_date = get_current_day()
+
+    # If it's a weekend, return "Lunch serveras ej" message
+    if current_weekday > 4:  # Saturday (5) or Sunday (6)
+        return get_weekend_info(restaurant_name, url, current_day, formatted_date)
+
+    url = resolve_restaurant_url(restaurant_name, url)
+
+    # First get the webpage content
+    content, encoding = get_webpage_content(url)
+    if not content:
+        print(f"Could not fetch content from {url}")
+        return None
+
+    page = parse_restaurant_page(restaurant_name, url, content, encoding, current_day)
+    return build_restaurant_info(restaurant_name, url, page, current_day, formatted_date)
+
+def scrape_restaurant(restaurant_name, url, cpu_pool, current_day, formatted_date):
+    """
+    Fetch, parse and build one restaurant's lunch information, parsing in cpu_pool
+    """
+    print(f"Getting lunch info for {restaurant_name}...")
+    url = resolve_restaurant_url(restaurant_name, url)
+
+    content, encoding = get_webpage_content(url)
+    if not content:
+        print(f"Could not fetch content from {url}")
+        return None
+
+    # Hand the raw bytes to the process pool and wait for the parsed page
+    page = cpu_pool.submit(parse_restaurant_page, restaurant_name, url, content, encoding, current_day).result()
+    return build_restaurant_info(restaurant_name, url, page, current_day, formatted_date)
+
+def scrape_restaurants(restaurants, fetch_workers=16, parse_workers=None):
+    """
+    Get lunch information for many restaurants concurrently.
+
+    Each restaurant runs on a thread pool: its page is downloaded, the CPU-bound
+    HTML parsing and menu extraction run in a process pool (one worker per core
+    by default), and the AI fallback runs as soon as that restaurant is parsed.
+    A failing restaurant is skipped. Results keep the restaurant order.
+    """
+    current_weekday, current_day, formatted_date = get_current_day()
+
+    # If it's a weekend, there is nothing to fetch
+    if current_weekday > 4:  # Saturday (5) or Sunday (6)
+        return [get_weekend_info(r['name'], r['url'], current_day, formatted_date) for r in restaurants]
+
+    # Forking a process whose I/O threads are busy can deadlock, so parse workers
+    # are started by a forkserver (or spawned where that is not available)
+    start_methods = multiprocessing.get_all_start_methods()
+    mp_context = multiprocessing.get_context("forkserver" if "forkserver" in start_methods else "spawn")
+
+    results = [None] * len(restaurants)
+    with ThreadPoolExecutor(max_workers=fetch_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers=parse_workers, mp_context=mp_context) as cpu_pool:
+        futures = {}
+        for index, restaurant in enumerate(restaurants):
+            future = io_pool.submit(
+                scrape_restaurant, restaurant['name'], restaurant['url'], cpu_pool, current_day, formatted_date
+            )
+            futures[future] = index
+
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"Error getting lunch info for {restaurants[index]['name']}: {e}")
+
+    return [result for result in results if result]
+
+def write_json(path, data):
+    """
+    Write data as indented UTF-8 JSON, using orjson when it is installed
+    """
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, default=MenuRecord.to_dict, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2, default=MenuRecord.to_dict)
+
+def write_version_manifest(data):
+    """
+    Write lunch_data_version.json with a content hash per restaurant and for the whole list.
+
+    The page fetches this small file to decide whether lunch_data.json changed
+    and which restaurants need to be re-rendered.
+    """
+    restaurant_hashes = {}
+    version = hashlib.sha256()
+    for record in data:
+        entry = record.to_dict() if isinstance(record, MenuRecord) else record
+        digest = hashlib.sha256(
+            json.dumps(entry, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:12]
+        restaurant_hashes[entry["restaurant_name"]] = digest
+        version.update(digest.encode('ascii'))
+    write_json('lunch_data_version.json', {
+        "version": version.hexdigest()[:12],
+        "restaurants": restaurant_hashes
+    })
+
+def write_lunch_data(data):
+    """
+    Write lunch_data.json together with its version manifest
+    """
+    write_json('lunch_data.json', data)
+    write_version_manifest(data)
 
 def save_to_json(data):
     """
-    Save data to JSON file with error handling
+    Save menu records to JSON file with error handling
     """
     try:
         # First try to read existing data
@@ -630,28 +897,27 @@ def save_to_json(data):
         
         # Only save if we have new data
         if data:
-            with open('lunch_data.json', 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            write_lunch_data(data)
             print("Data saved to lunch_data.json")
         else:
             print("No new data to save, keeping existing data")
             # Restore existing data if we have no new data
-            with open('lunch_data.json', 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, ensure_ascii=False, indent=2)
+            write_lunch_data(existing_data)
     except Exception as e:
         print(f"Error saving to JSON: {e}")
         # If we have existing data, restore it
         if existing_data:
-            with open('lunch_data.json', 'w', encoding='utf-8') as f:
-                json.dump(existing_data, f, ensure_ascii=False, indent=2)
+            write_lunch_data(existing_data)
             print("Restored existing data due to error")
         else:
             # If no existing data, save empty array
-            with open('lunch_data.json', 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
+            write_lunch_data([])
             print("Created empty JSON file due to error")
 
 def main():
+    print("Starting scraper...")
+    print(f"OpenAI API Key present: {'Yes' if os.getenv('OPENAI_API_KEY') else 'No'}")
+
     # List of restaurants to check
     restaurants = [
         {
@@ -669,13 +935,7 @@ def main():
     ]
     
     print(f"Starting lunch menu update for {datetime.now().strftime('%Y-%m-%d')}")
-    all_lunch_data = []
-    
-    for restaurant in restaurants:
-        print(f"Getting lunch info for {restaurant['name']}...")
-        restaurant_data = get_restaurant_info(restaurant['name'], restaurant['url'])
-        if restaurant_data:
-            all_lunch_data.append(json.loads(restaurant_data))
+    all_lunch_data = scrape_restaurants(restaurants)
     
     # Save all lunch data to a JSON file
     save_to_json(all_lunch_data)